@@ -5,176 +5,419 @@ Supports optional strict mode for spec compliance.
 """
 
 import argparse
+import codecs
+import contextlib
+import functools
 import hashlib
+import io
 import json
+import mmap
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import repeat
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# In lazy mode, dict values at least this long (e.g. "pieces") are returned as
+# memoryview slices of the input instead of being copied out.
+LAZY_MIN_LENGTH = 1 << 16
+
+# With more paths than this on the command line, queue readahead for all of them
+# before decoding the first one.
+PREFETCH_MIN_FILES = 8
+
+# With more paths than this, decode them in a pool of worker processes.
+PARALLEL_MIN_FILES = 16
+
 
 class InvalidFileException(Exception):
     """Raised when the input file is not a valid .torrent file."""
 
 
-def encode(obj):
+# Pre-encoded small integers, which cover most counts and flags in a torrent.
+_SMALL_INTS = [b"i%de" % i for i in range(-128, 1024)]
+
+
+def _encode_into(obj, out: bytearray):
     if isinstance(obj, int):
-        return b"i%de" % obj
-    if isinstance(obj, bytes):
-        return b"%d:%s" % (len(obj), obj)
-    if isinstance(obj, str):
-        return encode(obj.encode())
-    if isinstance(obj, list):
-        return b"l" + b"".join(map(encode, obj)) + b"e"
-    if isinstance(obj, dict):
-        return b"d" + b"".join(encode(k) + encode(v) for k, v in sorted(obj.items())) + b"e"
-    raise TypeError(f"Unsupported type: {type(obj)}")
-
-
-def tokenize(data: bytes):
-    i = 0
-    while i < len(data):
-        char = data[i : i + 1]
-        if char == b"i":
-            i += 1
-            end = data.index(b"e", i)
-            number = data[i:end]
-            if (
-                not number
-                or number == b"-"
-                or (number.lstrip(b"-").startswith(b"0") and len(number.lstrip(b"-")) > 1)
+        if -128 <= obj < 1024:
+            out += _SMALL_INTS[obj + 128]
+        else:
+            out += b"i%de" % obj
+    elif isinstance(obj, bytes):
+        out += b"%d:" % len(obj)
+        out += obj
+    elif isinstance(obj, str):
+        _encode_into(obj.encode(), out)
+    elif isinstance(obj, list):
+        out += b"l"
+        for item in obj:
+            _encode_into(item, out)
+        out += b"e"
+    elif isinstance(obj, dict):
+        out += b"d"
+        for k, v in sorted(obj.items()):
+            _encode_into(k, out)
+            _encode_into(v, out)
+        out += b"e"
+    else:
+        raise TypeError(f"Unsupported type: {type(obj)}")
+
+
+def encode(obj):
+    out = bytearray()
+    _encode_into(obj, out)
+    return bytes(out)
+
+
+def _parse(data: bytes, strict=False, lazy=False, decode_strings=False):
+    """Parse the value at the start of ``data``.
+
+    Returns the value, the position after it and the ``(start, end)`` byte span of
+    the top-level ``info`` value, or None if there is none.
+
+    Open lists and dicts are kept on an explicit stack instead of recursing, so
+    nesting depth is not bounded by the interpreter's recursion limit. With
+    ``lazy``, long dict values are memoryview slices of ``data`` (see
+    LAZY_MIN_LENGTH). With ``decode_strings``, strings are decoded to str as they
+    are read, and dict keys as they are inserted.
+    """
+    n = len(data)
+    # Decoded text is a copy anyway, so views would not save anything.
+    lazy = lazy and not decode_strings
+    view = memoryview(data) if lazy else None
+    find = data.find  # mmap objects have find() but no index()
+    # One [container, pending dict key, raw keys seen] frame per open list/dict.
+    stack = []
+    pos = info_start = 0
+    info_span = None
+    while True:
+        char = data[pos]
+        # Strings (every dict key included) are the most common value, so test them first.
+        if 0x30 <= char <= 0x39:  # 0-9
+            # Lengths are short, so accumulating the digits beats index() + int().
+            length = char - 0x30
+            pos += 1
+            while (char := data[pos]) != 0x3A:  # :
+                if not 0x30 <= char <= 0x39:
+                    raise SyntaxError(f"Invalid string length at byte {pos}")
+                length = length * 10 + char - 0x30
+                pos += 1
+            start = pos + 1
+            end = start + length
+            if end > n:
+                raise SyntaxError("Unexpected end of data in string")
+            # Only dict values may be views: keys must stay hashable bytes, and
+            # list items (e.g. path components) are printed, so copy those.
+            if lazy and length >= LAZY_MIN_LENGTH and stack and stack[-1][1] is not None:
+                value = view[start:end]
+            else:
+                value = data[start:end]
+            # Dict keys stay bytes until they are inserted, so that duplicates are
+            # detected on the raw key rather than on its decoded text.
+            if decode_strings and not (
+                stack and stack[-1][1] is None and type(stack[-1][0]) is dict
+            ):
+                value = _decode_text(value)
+            pos = end
+        elif char == 0x69:  # i
+            end = find(b"e", pos)
+            if end < 0:
+                raise SyntaxError(f"Unterminated integer at byte {pos}")
+            number = data[pos + 1 : end]
+            # Only a leading "-" or "0" can make the value invalid; test that first.
+            if not number or (
+                number[0] in b"-0"
+                and (
+                    number == b"-"
+                    or number.startswith(b"-0")
+                    or (number[0] == 0x30 and len(number) > 1)
+                )
             ):
                 raise SyntaxError(f"Invalid integer value: {number}")
-            yield from (b"i", number, b"e")
-            i = end + 1
-        elif char in (b"l", b"d", b"e"):
-            yield char
-            i += 1
-        elif b"0" <= char <= b"9":
-            colon = data.index(b":", i)
-            length = int(data[i:colon])
-            start, end = colon + 1, colon + 1 + length
-            if end > len(data):
-                raise SyntaxError("Unexpected end of data in string")
-            yield from (b"s", data[start:end])
-            i = end
+            value, pos = int(number), end + 1
+        elif char == 0x6C:  # l
+            stack.append([[], None, None])
+            pos += 1
+            continue
+        elif char == 0x64:  # d
+            value = {}
+            stack.append([value, None, set() if decode_strings else value])
+            pos += 1
+            continue
+        elif char == 0x65 and stack:  # e
+            value, key, _ = stack.pop()
+            if key is not None:
+                raise SyntaxError(f"Missing value for dictionary key {key!r} at byte {pos}")
+            pos += 1
         else:
-            raise SyntaxError(f"Unexpected character: {char!r} at byte {i}")
-
-
-def decode_item(next_token, token, strict=False):
-    if token == b"i":
-        value = int(next_token())
-        if next_token() != b"e":
-            raise ValueError("Invalid integer termination")
-        return value
-    if token == b"s":
-        return next_token()
-    if token == b"l":
-        result = []
-        while (token := next_token()) != b"e":
-            result.append(decode_item(next_token, token, strict))
-        return result
-    if token == b"d":
-        result = {}
-        while (token := next_token()) != b"e":
-            key = decode_item(next_token, token, strict)
-            if strict and not isinstance(key, bytes):
-                raise TypeError(f"Invalid dict key type {type(key).__name__}, expected bytes")
-            if key in result:
-                raise ValueError(f"Duplicate key in dictionary: {key!r}")
-            result[key] = decode_item(next_token, next_token(), strict)
-        return result
-    raise ValueError(f"Unexpected token: {token}")
-
-
-def decode(data: bytes, strict=False):
-    tokens = tokenize(data)
-    result = decode_item(tokens.__next__, next(tokens), strict)
+            raise SyntaxError(f"Unexpected character: {data[pos : pos + 1]!r} at byte {pos}")
+
+        if not stack:
+            return value, pos, info_span
+        frame = stack[-1]
+        container, key, seen = frame
+        if type(container) is list:
+            container.append(value)
+        elif key is None:
+            if strict and not isinstance(value, bytes):
+                raise TypeError(f"Invalid dict key type {type(value).__name__}, expected bytes")
+            if value in seen:
+                raise ValueError(f"Duplicate key in dictionary: {value!r}")
+            if seen is not container:
+                seen.add(value)
+            frame[1] = value
+            if len(stack) == 1:
+                info_start = pos
+        else:
+            # Keys recur across sibling dicts, so mydecode() caches the short ones.
+            # Distinct raw keys that decode to the same text keep the last value.
+            container[mydecode(key) if decode_strings else key] = value
+            if key == b"info" and len(stack) == 1:
+                info_span = (info_start, pos)
+            frame[1] = None
+
+
+def _decode(data: bytes, strict=False, lazy=False, decode_strings=False):
     try:
-        next(tokens)
+        result, end, info_span = _parse(data, strict, lazy, decode_strings)
+    except IndexError:
+        raise SyntaxError("Unexpected end of data") from None
+    if end != len(data):
         raise SyntaxError("Trailing data after valid bencode")
-    except StopIteration:
-        pass
-    return result
+    return result, info_span
+
+
+def decode(data: bytes, strict=False, *, decode_strings=False):
+    return _decode(data, strict, decode_strings=decode_strings)[0]
+
+
+def _decode_text(s: bytes) -> str:
+    try:
+        return s.decode("utf-8")
+    except UnicodeDecodeError:
+        return s.decode("latin1")
+
+
+_decode_text_cached = functools.lru_cache(maxsize=1024)(_decode_text)
 
 
 def mydecode(s):
+    if isinstance(s, memoryview):
+        s = bytes(s)
     if isinstance(s, bytes):
-        try:
-            return s.decode("utf-8")
-        except UnicodeDecodeError:
-            return s.decode("latin1", errors="replace")
+        # Short strings such as keys recur; keep long values out of the cache.
+        if len(s) > 256:
+            return _decode_text(s)
+        return _decode_text_cached(s)
     return s
 
 
-def print_files(files_list):
+def format_files(files_list):
+    lines = []
     for file_entry in files_list:
         length = str(file_entry.get(b"length", 0)).rjust(35)
         path = file_entry.get(b"path.utf-8") or file_entry.get(b"path")
 
         if not isinstance(path, list):
-            print(f"Expected list but got {type(path).__name__}")
+            lines.append(f"Expected list but got {type(path).__name__}")
             continue
 
-        parts = [
-            p.decode("utf-8", errors="replace") if isinstance(p, bytes) else str(p) for p in path
-        ]
-        print(f"{length} {'/'.join(parts)}")
+        # File names are mostly unique, so skip the cache that mydecode() uses.
+        parts = [_decode_text(p) if isinstance(p, bytes) else str(mydecode(p)) for p in path]
+        lines.append(f"{length} {'/'.join(parts)}")
+    return lines
+
+
+def print_files(files_list):
+    lines = format_files(files_list)
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
 
 
 def decode_keys(obj):
-    """Recursively decode all dict keys and values into str for JSON output."""
-    if isinstance(obj, dict):
-        return {
-            (k.decode("utf-8", "replace") if isinstance(k, bytes) else k): decode_keys(v)
-            for k, v in obj.items()
-        }
-    if isinstance(obj, list):
-        return [decode_keys(i) for i in obj]
-    if isinstance(obj, bytes):
-        return obj.decode("utf-8", "replace")
-    return obj
+    """Decode all dict keys and values into str for JSON output.
+
+    Strings are decoded as UTF-8 with a Latin-1 fallback, like mydecode(), so
+    ``decode_keys(decode(data))`` equals ``decode(data, decode_strings=True)``.
+    Nested containers are walked with an explicit stack rather than recursion.
+    """
+    stack = []
+
+    def convert(value):
+        if isinstance(value, (bytes, memoryview)):
+            return _decode_text(bytes(value))
+        if isinstance(value, dict):
+            new = {}
+        elif isinstance(value, list):
+            new = [None] * len(value)
+        else:
+            return value
+        # Filled in when the (old, new) pair is popped off the stack.
+        stack.append((value, new))
+        return new
+
+    result = convert(obj)
+    while stack:
+        node, new = stack.pop()
+        if isinstance(node, dict):
+            for k, v in node.items():
+                new[mydecode(k)] = convert(v)
+        else:
+            for i, v in enumerate(node):
+                new[i] = convert(v)
+    return result
+
+
+def _stdout_is_utf8() -> bool:
+    # Worker processes capture stdout in a StringIO, which has no encoding; their
+    # output ends up on the real stdout, so check that instead.
+    stream = sys.stdout if getattr(sys.stdout, "encoding", None) else sys.__stdout__
+    encoding = getattr(stream, "encoding", None)
+    return bool(encoding) and codecs.lookup(encoding).name == "utf-8"
+
+
+def dumps_json(obj, use_orjson=False) -> str:
+    """Serialise ``obj`` for -j output.
+
+    With ``use_orjson``, the output uses orjson's layout: two-space indentation
+    and non-ASCII characters written raw. Objects orjson rejects, such as
+    integers wider than 64 bits, are written by json in that same layout, so the
+    format only depends on ``use_orjson``.
+    """
+    if use_orjson:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode()
+        except orjson.JSONEncodeError:
+            return json.dumps(obj, indent=2, sort_keys=True, ensure_ascii=False)
+    return json.dumps(obj, indent=4, sort_keys=True)
 
 
 def main(file_data: bytes, file_path: Path, print_json=False, strict=False):
-    torrent = decode(file_data, strict=strict)
+    # The text report never prints "pieces", so let it stay a view into file_data.
+    # JSON output needs str throughout, so decode strings while parsing instead.
+    torrent, info_span = _decode(
+        file_data, strict=strict, lazy=not print_json, decode_strings=print_json
+    )
 
-    if b"info" not in torrent:
+    if info_span is None:
         raise InvalidFileException(
             "No 'info' dictionary found in .torrent file. Is it a valid torrent?"
         )
 
-    info_dict = torrent[b"info"]
-    info_encoded = encode(info_dict)
-    torrent["info_hash"] = hashlib.sha1(info_encoded).hexdigest()
+    # Hash the info dict exactly as it appears in the file rather than re-encoding it.
+    # A memoryview slice hands the bytes to hashlib's OpenSSL SHA-1 without a copy.
+    info_start, info_end = info_span
+    info_hash = hashlib.sha1()
+    info_hash.update(memoryview(file_data)[info_start:info_end])
+    torrent["info_hash"] = info_hash.hexdigest()
 
     if print_json:
-        print(json.dumps(decode_keys(torrent), indent=4, sort_keys=True))
+        # orjson writes non-ASCII characters raw, so only use it on a UTF-8 stdout.
+        use_orjson = orjson is not None and _stdout_is_utf8()
+        print(dumps_json(torrent, use_orjson=use_orjson))
         return
 
-    print(f"{'torrent file':>15} : {file_path}")
+    # Collect the report and write it in one go rather than a print() per line.
+    lines = [f"{'torrent file':>15} : {file_path}"]
     for k, v in torrent.items():
         k_str, v = mydecode(k), mydecode(v)
 
         if isinstance(v, list):
-            print(f"{k_str:>15} : ")
+            lines.append(f"{k_str:>15} : ")
             for vi in v:
-                print(f"{'':>20}{mydecode(vi[0])}")
+                lines.append(f"{'':>20}{mydecode(vi[0])}")
         elif isinstance(v, dict):
-            print(f"{k_str:>15} : ")
+            lines.append(f"{k_str:>15} : ")
             for ki, vi in v.items():
                 ki = mydecode(ki)
                 if ki == "pieces":
-                    print(f"{ki:>25} : SKIPPING (too long)")
+                    lines.append(f"{ki:>25} : SKIPPING (too long)")
                 elif ki == "files":
-                    print(f"{ki:>25} : ")
-                    print_files(vi)
+                    lines.append(f"{ki:>25} : ")
+                    lines.extend(format_files(vi))
                 else:
-                    print(f"{ki:>25} : {mydecode(vi)}")
+                    lines.append(f"{ki:>25} : {mydecode(vi)}")
         else:
             if k_str == "creation date":
                 v = datetime.fromtimestamp(v).strftime("%Y-%m-%d %H:%M:%S")
-            print(f"{k_str:>15} : {v}")
-    print()
+            lines.append(f"{k_str:>15} : {v}")
+    lines.append("")
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
+def _is_torrent_file(path: Path) -> bool:
+    return path.is_file() and path.suffix in {".torrent", ".added"}
+
+
+def inspect_file(path: Path, print_json=False, strict=False):
+    """Run main() on a read-only mmap of ``path``, reporting decode errors."""
+    with path.open("rb") as f:
+        # Mapping lets the kernel page the file in on demand instead of copying it
+        # onto the heap. Empty files cannot be mapped, so hand those over as b"".
+        # The map is not closed explicitly: lazy values may still be views into it,
+        # and it is unmapped once the last of them is released.
+        size = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+    try:
+        main(data, path, print_json=print_json, strict=strict)
+    except (InvalidFileException, SyntaxError, ValueError, TypeError) as e:
+        print(f"Error processing {path.name}: {e}")
+
+
+def prefetch_files(paths):
+    """Ask the kernel to start reading the torrents among ``paths`` into the page cache."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in paths:
+        if not _is_torrent_file(path):
+            continue
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+
+def inspect_path(path: Path, print_json=False, strict=False):
+    if _is_torrent_file(path):
+        inspect_file(path, print_json=print_json, strict=strict)
+    else:
+        print(f"Skipping invalid file: {path}")
+
+
+def _report(path: Path, print_json=False, strict=False) -> str:
+    """Return what inspect_path() prints for ``path``, for use in a worker process."""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        inspect_path(path, print_json=print_json, strict=strict)
+    return out.getvalue()
+
+
+def inspect_paths(paths, print_json=False, strict=False):
+    """Print a report for each of ``paths``, using a process pool for large batches."""
+    workers = os.cpu_count() or 1
+    if len(paths) > PARALLEL_MIN_FILES and workers > 1:
+        # Reports come back in submission order, so output matches a sequential run.
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(paths) // (4 * workers))
+            reports = pool.map(
+                _report, paths, repeat(print_json), repeat(strict), chunksize=chunksize
+            )
+            for report in reports:
+                sys.stdout.write(report)
+    else:
+        for path in paths:
+            inspect_path(path, print_json=print_json, strict=strict)
 
 
 if __name__ == "__main__":
@@ -189,11 +432,7 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    for path in args.path:
-        if path.is_file() and path.suffix in {".torrent", ".added"}:
-            try:
-                main(path.read_bytes(), path, print_json=args.json, strict=args.strict)
-            except (InvalidFileException, SyntaxError, ValueError, TypeError) as e:
-                print(f"Error processing {path.name}: {e}")
-        else:
-            print(f"Skipping invalid file: {path}")
+    if len(args.path) > PREFETCH_MIN_FILES:
+        prefetch_files(args.path)
+
+    inspect_paths(args.path, print_json=args.json, strict=args.strict)
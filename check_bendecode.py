@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Regression checks for the bencode decoder and encoder.
+
+Run with ``python3 check_bendecode.py``. Cases whose outcome differs from the
+original tokenizer-based decoder say so in a "baseline:" comment.
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+import bendecode
+from bendecode import (
+    LAZY_MIN_LENGTH,
+    PARALLEL_MIN_FILES,
+    _decode,
+    _decode_text_cached,
+    _report,
+    decode,
+    decode_keys,
+    dumps_json,
+    encode,
+    format_files,
+    inspect_file,
+    inspect_paths,
+    main,
+    mydecode,
+    print_files,
+)
+
+SAMPLES = [
+    0,
+    -7,
+    2**70,
+    b"",
+    b"spam",
+    bytes(range(256)),
+    [],
+    {},
+    [1, [b"a", [b"b", {}]], {b"k": -1}],
+    {
+        b"announce": b"udp://tracker:1337",
+        b"creation date": 1362491290,
+        b"info": {
+            b"files": [{b"length": 41978, b"path": [b"dir", b"caf\xe9.srt"]}],
+            b"name": b"The Terminator (1984) [1080p]",
+            b"piece length": 2097152,
+            b"pieces": bytes(range(40)),
+        },
+    },
+]
+
+VALID = [
+    (b"i0e", 0),
+    (b"i-12e", -12),
+    (b"i1180591620717411303424e", 2**70),
+    (b"0:", b""),
+    (b"4:spam", b"spam"),
+    (b"le", []),
+    (b"de", {}),
+    (b"l4:spami42ee", [b"spam", 42]),
+    (b"d3:bar4:spam3:fooi42ee", {b"bar": b"spam", b"foo": 42}),
+    (b"d1:zi1e1:ai2ee", {b"z": 1, b"a": 2}),  # unsorted keys are accepted
+]
+
+TORRENT = {
+    b"announce": b"udp://tracker:1337",
+    b"info": {
+        b"files": [{b"length": 7, b"path": [b"dir", b"a.txt"]}],
+        b"name": b"demo",
+        b"piece length": 16384,
+        b"pieces": b"p" * 20,
+    },
+}
+
+TORRENT_TEXT = """\
+   torrent file : demo.torrent
+       announce : udp://tracker:1337
+           info : 
+                    files : 
+                                  7 dir/a.txt
+                     name : demo
+             piece length : 16384
+                   pieces : SKIPPING (too long)
+      info_hash : fa9aea7b7f5f418a45d8f6a8e1bb4c88746f2be9
+
+"""
+
+# (data, strict, exception type, message fragment)
+INVALID = [
+    (b"", False, SyntaxError, "Unexpected end of data"),  # baseline: StopIteration
+    (b"l", False, SyntaxError, "Unexpected end of data"),  # baseline: StopIteration
+    (b"ie", False, SyntaxError, "Invalid integer value"),
+    (b"i-e", False, SyntaxError, "Invalid integer value"),
+    (b"i01e", False, SyntaxError, "Invalid integer value"),
+    (b"i12", False, SyntaxError, "Unterminated integer"),  # baseline: ValueError
+    (b"i-0e", False, SyntaxError, "Invalid integer value"),  # baseline: accepted as 0
+    (b"3:ab", False, SyntaxError, "Unexpected end of data in string"),
+    (b"1_0:abcdefghij", False, SyntaxError, "Invalid string length"),  # baseline: accepted
+    (b"3x:abc", False, SyntaxError, "Invalid string length"),
+    (b"e", False, SyntaxError, "Unexpected character"),  # baseline: ValueError
+    (b"x", False, SyntaxError, "Unexpected character"),
+    (b"i1ei2e", False, SyntaxError, "Trailing data"),
+    (b"i1ex", False, SyntaxError, "Trailing data"),  # baseline: "Unexpected character"
+    (b"d1:ae", False, SyntaxError, "Missing value"),  # baseline: ValueError
+    (b"d1:ai1e1:ai2ee", False, ValueError, "Duplicate key"),
+    (b"di1ei2ee", True, TypeError, "expected bytes"),
+]
+
+
+def check_round_trip():
+    for obj in SAMPLES:
+        data = encode(obj)
+        assert decode(data) == obj, obj
+        assert encode(decode(data)) == data, data
+
+
+def check_encode():
+    assert encode(True) == b"i1e"
+    assert encode(False) == b"i0e"
+    for n in (-129, -128, -1, 0, 1023, 1024):  # around the pre-encoded range
+        assert encode(n) == b"i%de" % n, n
+    assert encode("café") == b"5:caf\xc3\xa9"
+    assert encode({b"b": 1, b"a": 2}) == b"d1:ai2e1:bi1ee"
+    try:
+        encode(1.5)
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("encode(1.5) did not raise TypeError")
+
+
+def check_valid():
+    for data, expected in VALID:
+        assert decode(data) == expected, data
+    deep = b"l" * 100000 + b"e" * 100000
+    assert isinstance(decode(deep), list)
+
+
+def check_invalid():
+    for data, strict, exc_type, fragment in INVALID:
+        for decode_strings in (False, True):
+            try:
+                decode(data, strict=strict, decode_strings=decode_strings)
+            except exc_type as e:
+                assert fragment in str(e), (data, str(e))
+            else:
+                raise AssertionError(f"{data!r} did not raise {exc_type.__name__}")
+
+
+def check_mydecode():
+    assert mydecode(b"caf\xc3\xa9") == "café"
+    assert mydecode(b"caf\xe9") == "café"  # not UTF-8: Latin-1 fallback
+    assert mydecode(memoryview(b"abc")) == "abc"
+    assert mydecode(7) == 7
+    _decode_text_cached.cache_clear()
+    assert mydecode(b"x" * 257) == "x" * 257
+    assert _decode_text_cached.cache_info().currsize == 0  # long strings bypass the cache
+
+
+def check_decode_keys():
+    obj = {b"caf\xe9": [b"caf\xc3\xa9", 1, {memoryview(b"k"): memoryview(b"v")}], 2: None}
+    assert decode_keys(obj) == {"café": ["café", 1, {"k": "v"}], 2: None}
+    deep = decode(b"l" * 100000 + b"e" * 100000)
+    assert isinstance(decode_keys(deep), list)
+
+
+def check_decode_strings():
+    for obj in SAMPLES + [TORRENT]:
+        data = encode(obj)
+        assert decode(data, decode_strings=True) == decode_keys(decode(data)), obj
+    # Distinct raw keys that decode to the same text are not duplicates.
+    assert decode(b"d5:caf\xc3\xa9i1e4:caf\xe9i2ee", decode_strings=True) == {"café": 2}
+    _decode_text_cached.cache_clear()
+    long_key = b"k" * 257
+    assert decode(encode({long_key: b"v"}), decode_strings=True) == {"k" * 257: "v"}
+    assert _decode_text_cached.cache_info().currsize == 0
+    data = b"d8:announce1:x4:infod1:ai1ee1:zl4:infoi2eee"
+    torrent, (start, end) = _decode(data, decode_strings=True)
+    assert torrent["info"] == {"a": 1}
+    assert data[start:end] == b"d1:ai1ee"
+
+
+def check_info_span():
+    data = b"d8:announce1:x4:infod1:ai1ee1:zl4:infoi2eee"
+    torrent, (start, end) = _decode(data)
+    assert data[start:end] == encode(torrent[b"info"])
+    assert _decode(b"li1ee")[1] is None
+
+
+def check_lazy():
+    big = b"x" * LAZY_MIN_LENGTH
+    torrent = {b"info": {b"files": [{b"length": 1, b"path": [big]}], b"pieces": big}}
+    data = encode(torrent)
+    lazy, _ = _decode(data, lazy=True)
+    assert isinstance(lazy[b"info"][b"pieces"], memoryview)
+    assert lazy[b"info"][b"pieces"] == big
+    assert type(lazy[b"info"][b"files"][0][b"path"][0]) is bytes
+    assert lazy == decode(data)
+    # Long keys stay bytes, so strict mode still accepts them and they hash.
+    data = encode({big: 1, b"a": {big + b"y": big}})
+    lazy, _ = _decode(data, strict=True, lazy=True)
+    assert all(type(k) is bytes for k in lazy)
+    assert all(type(k) is bytes for k in lazy[b"a"])
+    assert lazy == decode(data)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        print_files([{b"length": 3, b"path": [b"dir", memoryview(b"caf\xc3\xa9")]}])
+    assert out.getvalue() == " " * 34 + "3 dir/café\n", out.getvalue()
+
+
+def check_format_files():
+    files = [
+        {b"length": 7, b"path": [b"dir", b"a.txt"]},
+        {b"length": 3, b"path": [memoryview(b"caf\xc3\xa9")], b"path.utf-8": None},
+        {b"length": 5, b"path": b"flat"},
+        {b"length": 2, b"path": [b"caf\xe9"]},  # not UTF-8: Latin-1, not U+FFFD
+        {b"path.utf-8": [b"utf8"], b"path": [b"legacy"]},
+    ]
+    assert format_files(files) == [
+        " " * 34 + "7 dir/a.txt",
+        " " * 34 + "3 café",
+        "Expected list but got bytes",
+        " " * 34 + "2 café",
+        " " * 34 + "0 utf8",
+    ]
+    assert format_files([]) == []
+
+
+def run_main(data, path=Path("demo.torrent"), **kwargs):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        main(data, path, **kwargs)
+    return out.getvalue()
+
+
+def check_main():
+    data = encode(TORRENT)
+    assert run_main(data) == TORRENT_TEXT
+    info_hash = hashlib.sha1(encode(TORRENT[b"info"])).hexdigest()
+    assert json.loads(run_main(data, print_json=True)) == {
+        "announce": "udp://tracker:1337",
+        "info": {
+            "files": [{"length": 7, "path": ["dir", "a.txt"]}],
+            "name": "demo",
+            "piece length": 16384,
+            "pieces": "p" * 20,
+        },
+        "info_hash": info_hash,
+    }
+
+
+def check_dumps_json():
+    obj = {"n": 2**70, "s": "caf\xe9", "l": [1, {}]}
+    assert dumps_json(obj) == json.dumps(obj, indent=4, sort_keys=True)
+    if bendecode.orjson is not None:
+        # orjson rejects integers wider than 64 bits; json takes over in the same layout.
+        two_space = json.dumps(obj, indent=2, sort_keys=True, ensure_ascii=False)
+        assert dumps_json(obj, use_orjson=True) == two_space
+        del obj["n"]
+        assert dumps_json(obj, use_orjson=True) == json.dumps(
+            obj, indent=2, sort_keys=True, ensure_ascii=False
+        )
+
+
+def check_main_json_fallbacks():
+    torrent = {b"big": 2**70, b"info": {b"name": "café ✓".encode(), b"pieces": b"p" * 20}}
+    data = encode(torrent)
+    assert json.loads(run_main(data, print_json=True))["big"] == 2**70
+    # A stdout that cannot encode every character gets \u escapes instead of a codec error.
+    raw = io.BytesIO()
+    out = io.TextIOWrapper(raw, encoding="cp1252")
+    with contextlib.redirect_stdout(out):
+        main(data, Path("demo.torrent"), print_json=True)
+    out.flush()
+    text = raw.getvalue().decode("ascii")
+    assert json.loads(text)["info"]["name"] == "café ✓"
+
+
+def check_inspect_file():
+    with tempfile.TemporaryDirectory() as tmp:
+        empty = Path(tmp, "empty.torrent")
+        empty.write_bytes(b"")
+        demo = Path(tmp, "demo.torrent")
+        demo.write_bytes(encode(TORRENT))
+        for kwargs in ({}, {"print_json": True}):
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                inspect_file(empty, **kwargs)
+                inspect_file(demo, **kwargs)
+            expected = "Error processing empty.torrent: Unexpected end of data\n"
+            assert out.getvalue() == expected + run_main(encode(TORRENT), demo, **kwargs)
+
+
+def check_inspect_paths():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [Path(tmp, "notes.txt"), Path(tmp, "missing.torrent")]
+        for i in range(PARALLEL_MIN_FILES):
+            torrent = {b"info": {b"name": b"t%d" % i, b"length": i}}
+            paths.append(Path(tmp, f"t{i}.torrent" if i % 3 else f"t{i}.added"))
+            paths[-1].write_bytes(encode(torrent))
+        paths[0].write_text("not a torrent")
+        for print_json in (False, True):
+            expected = "".join(_report(p, print_json) for p in paths)
+            assert expected.count("Skipping invalid file") == 2
+            # More than PARALLEL_MIN_FILES paths: reports must keep the input order.
+            # Pretend to have several cores so the pool is used on any machine.
+            cpu_count = bendecode.os.cpu_count
+            bendecode.os.cpu_count = lambda: 4
+            out = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(out):
+                    inspect_paths(paths, print_json=print_json)
+            finally:
+                bendecode.os.cpu_count = cpu_count
+            assert out.getvalue() == expected
+
+
+if __name__ == "__main__":
+    checks = [f for name, f in sorted(globals().items()) if name.startswith("check_")]
+    failed = 0
+    for check in checks:
+        try:
+            check()
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {check.__name__}: {e}")
+        else:
+            print(f"ok   {check.__name__}")
+    sys.exit(1 if failed else 0)